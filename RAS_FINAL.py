@@ -5,23 +5,53 @@ import time
 import adafruit_ads1x15.ads1115 as ADS
 from adafruit_ads1x15.analog_in import AnalogIn
 import datetime
-import http.client
-import urllib
 import RPi.GPIO as GPIO
 from ds18b20 import DS18B20
 import json
 import shutil
-from threading import Timer
-import logging
+import signal
+import asyncio
 import statistics
-import ssl
+import collections
+import threading
+import concurrent.futures
+import logging
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import subprocess
 import smbus2
 import yaml
 import os
 from dotenv import load_dotenv
 
+# MQTT is preferred for telemetry (single long-lived TLS connection);
+# HTTPS remains available as fallback if paho-mqtt is not installed
+try:
+    import paho.mqtt.client as mqtt
+    MQTT_AVAILABLE = True
+except ImportError:
+    mqtt = None
+    MQTT_AVAILABLE = False
+
+# Fast C JSON serializer when available (orjson returns bytes, so no
+# UTF-8 re-encode before the socket); stdlib json is the last resort
+try:
+    import orjson
+
+    def json_dumps(payload):
+        return orjson.dumps(payload)
+except ImportError:
+    try:
+        import ujson
+
+        def json_dumps(payload):
+            return ujson.dumps(payload)
+    except ImportError:
+        def json_dumps(payload):
+            return json.dumps(payload, separators=(',', ':'))
+
 # Load environment variables from RAS.env
 load_dotenv('RAS.env')
 
@@ -49,12 +79,50 @@ PUBLISH_INTERVAL = config['sensors']['publish_interval']
 SAMPLE_COUNT = config['sensors']['sample_count']
 DISCARD_COUNT = config['sensors']['discard_count']
 
+# One ADS1115 conversion period at 860 SPS (~1.2ms, with margin);
+# pacing samples by this instead of a fixed 100ms keeps the sample
+# count without blocking the cycle for a second per sensor
+ADS_CONVERSION_PERIOD = 1.3e-3
+
+# JIT-compile the trimmed-mean kernel when numba is installed; with the
+# fast DRDY-paced sampling the filter arithmetic is no longer hidden
+# behind sensor sleeps, so the compiled version is worth having
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    njit = None
+    NUMBA_AVAILABLE = False
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True, fastmath=True)
+    def _trimmed_mean(buf, count, discard):
+        arr = np.sort(buf[:count])
+        if discard > 0:
+            arr = arr[discard:count - discard]
+        return arr.mean()
+else:
+    def _trimmed_mean(buf, count, discard):
+        # Partial sort is O(n); only the discard boundaries need placing
+        if discard > 0:
+            arr = np.partition(buf[:count], (discard, count - discard - 1))[discard:count - discard]
+        else:
+            arr = buf[:count]
+        return arr.mean()
+
 # UPS Configuration from config
 UPS_CHECK_INTERVAL = config['ups']['check_interval']
 UPS_SHUTDOWN_THRESHOLD = config['ups']['shutdown_threshold']
 UPS_I2C_ADDR = config['ups']['i2c_address']
 UPS_BATTERY_REG = 0x02
 
+# Candidate sysfs battery nodes, used as fallback when I2C reads fail
+UPS_BATTERY_PATHS = (
+    "/sys/class/power_supply/ups-battery/capacity",
+    "/sys/class/power_supply/battery/capacity",
+    "/sys/class/power_supply/ups/capacity",
+)
+
 # Device credentials from passwords.env
 DEVICE_CREDENTIALS = {
     "temperature": os.getenv('TB_TEMPERATURE_TOKEN'),
@@ -69,13 +137,36 @@ DEVICE_CREDENTIALS = {
 # Thresholds from config
 ALERT_THRESHOLDS = config['alert_thresholds']
 
+# Fixed sensor order shared by the data cache and the CSV columns,
+# plus a pre-rendered line template (timestamp + one slot per sensor)
+SENSOR_KEYS = ("temperature", "pH", "conductivity", "level",
+               "recirc_pump", "dispense_pump", "ups_battery")
+CSV_FMT = "{},{},{},{},{},{},{},{}\n"
+
+# Shared keep-alive session for Pushover notifications so each alert
+# reuses one TLS connection instead of performing a fresh handshake
+pushover_session = requests.Session()
+PUSHOVER_API_URL = "https://api.pushover.net/1/messages.json"
+
 class UPSMonitor:
     def __init__(self, shutdown_threshold=20, check_interval=60):
         self.shutdown_threshold = shutdown_threshold
         self.check_interval = check_interval
         self.shutdown_triggered = False
         self.last_battery_level = 100
-        
+
+        # Keep one I2C bus handle open for the process lifetime instead
+        # of opening/closing /dev/i2c-N on every poll
+        self._bus = None
+        try:
+            self._bus = smbus2.SMBus(config['hardware']['i2c_bus'])
+        except Exception as e:
+            logger.error(f"Could not open I2C bus for UPS: {e}")
+
+        # Discover the sysfs fallback node once so failed I2C reads
+        # don't re-probe the candidate paths on every poll
+        self._sysfs_path = next((p for p in UPS_BATTERY_PATHS if os.path.exists(p)), None)
+
     def get_battery_level(self):
         """
         Read battery level from Waveshare UPS HAT
@@ -83,40 +174,31 @@ class UPSMonitor:
         """
         try:
             # Method 1: Read from I2C (primary method for Waveshare UPS)
-            bus = smbus2.SMBus(config['hardware']['i2c_bus'])
-            
-            # Read 2 bytes from battery level register
-            data = bus.read_word_data(UPS_I2C_ADDR, UPS_BATTERY_REG)
-            
-            # Convert to percentage (adjust based on your specific Waveshare UPS)
-            battery_level = data & 0xFF
-            
+            if self._bus is None:
+                self._bus = smbus2.SMBus(config['hardware']['i2c_bus'])
+
+            # Only the low byte of the battery register is used, so a
+            # single-byte read keeps one byte off the I2C wire
+            data = self._bus.read_byte_data(UPS_I2C_ADDR, UPS_BATTERY_REG)
+
             # Ensure value is within valid range
-            battery_level = max(0, min(100, battery_level))
-            
-            bus.close()
+            battery_level = max(0, min(100, data))
+
             return battery_level
-            
+
         except Exception as e:
             logger.error(f"Error reading UPS battery via I2C: {e}")
-            
+
             # Method 2: Try sysfs interface (alternative method)
             try:
-                battery_paths = [
-                    "/sys/class/power_supply/ups-battery/capacity",
-                    "/sys/class/power_supply/battery/capacity",
-                    "/sys/class/power_supply/ups/capacity",
-                ]
-                
-                for path in battery_paths:
-                    if os.path.exists(path):
-                        with open(path, 'r') as f:
-                            level = int(f.read().strip())
-                            logger.info(f"Read UPS battery from sysfs: {level}%")
-                            return level
+                if self._sysfs_path is not None:
+                    with open(self._sysfs_path, 'r') as f:
+                        level = int(f.read().strip())
+                        logger.info(f"Read UPS battery from sysfs: {level}%")
+                        return level
             except Exception as e2:
                 logger.error(f"Error reading UPS battery from sysfs: {e2}")
-                
+
         return None
         
     def safe_shutdown(self):
@@ -152,23 +234,18 @@ class UPSMonitor:
     def send_emergency_notification(self, message):
         """Send emergency shutdown notification via Pushover"""
         try:
-            context = ssl.create_default_context()
-            conn = http.client.HTTPSConnection("api.pushover.net:443", context=context)
-            conn.request("POST", "/1/messages.json",
-                urllib.parse.urlencode({
-                    "token": PUSHOVER_TOKEN,
-                    "user": PUSHOVER_USER,
-                    "message": message,
-                    "priority": 2,  # Emergency priority
-                    "retry": 30,    # Retry every 30 seconds
-                    "expire": 300   # Stop retrying after 5 minutes
-                }), {"Content-type": "application/x-www-form-urlencoded"})
-            response = conn.getresponse()
-            if response.status != 200:
-                logger.error(f"Emergency notification failed: {response.status} {response.reason}")
+            response = pushover_session.post(PUSHOVER_API_URL, data={
+                "token": PUSHOVER_TOKEN,
+                "user": PUSHOVER_USER,
+                "message": message,
+                "priority": 2,  # Emergency priority
+                "retry": 30,    # Retry every 30 seconds
+                "expire": 300   # Stop retrying after 5 minutes
+            }, timeout=30)
+            if response.status_code != 200:
+                logger.error(f"Emergency notification failed: {response.status_code} {response.reason}")
             else:
                 logger.info("Emergency notification sent successfully")
-            conn.close()
         except Exception as e:
             logger.error(f"Failed to send emergency notification: {str(e)}")
             
@@ -197,70 +274,140 @@ class UPSMonitor:
                     
         else:
             logger.warning("Could not read UPS battery level")
-            
+
         return True  # Continue monitoring
 
+    def close(self):
+        """Release the persistent I2C bus handle"""
+        if self._bus is not None:
+            try:
+                self._bus.close()
+            except Exception as e:
+                logger.error(f"Error closing UPS I2C bus: {e}")
+            self._bus = None
+
+class ThingsBoardMQTTClient:
+    def __init__(self):
+        # Strip the scheme; paho wants a bare hostname
+        self.host = THINGSBOARD_URL.replace("https://", "").replace("http://", "")
+        self.port = config['thingsboard'].get('mqtt_port', 8883)
+        self.clients = {}
+
+        # One persistent TLS connection per distinct device token,
+        # established once at startup and reused for every publish.
+        # If any token fails to connect, tear down the clients that
+        # already succeeded so nothing leaks when the caller falls
+        # back to HTTPS
+        try:
+            for device_name, token in DEVICE_CREDENTIALS.items():
+                if not token or token in self.clients:
+                    continue
+                client = mqtt.Client()
+                client.tls_set()
+                client.username_pw_set(token)
+                client.connect(self.host, self.port, keepalive=60)
+                client.loop_start()
+                self.clients[token] = client
+        except Exception:
+            self.disconnect()
+            raise
+
+        logger.info(f"ThingsBoard MQTT client initialized ({len(self.clients)} connections)")
+
+    def send_batch(self, token, data, ts=None):
+        """Publish a batch of telemetry key/value pairs over the persistent MQTT connection"""
+        try:
+            client = self.clients.get(token)
+            if client is None:
+                logger.error("No MQTT connection for token")
+                return False
+
+            payload = dict(data)
+            payload["ts"] = ts if ts is not None else int(time.time() * 1000)
+
+            logger.debug(f"Publishing telemetry batch: {payload}")
+
+            result = client.publish("v1/devices/me/telemetry", json_dumps(payload), qos=1)
+            if result.rc == mqtt.MQTT_ERR_SUCCESS:
+                logger.info(f"MQTT telemetry batch SENT ({len(data)} sensors)")
+                return True
+            else:
+                logger.error(f"MQTT telemetry batch FAILED: rc={result.rc}")
+                return False
+
+        except Exception as e:
+            logger.error(f"MQTT telemetry batch exception: {str(e)}")
+            return False
+
+    def disconnect(self):
+        """Shut down all persistent MQTT connections"""
+        for client in self.clients.values():
+            try:
+                client.loop_stop()
+                client.disconnect()
+            except Exception as e:
+                logger.error(f"MQTT disconnect error: {str(e)}")
+
 class ThingsBoardHTTPClient:
     def __init__(self):
         self.base_url = THINGSBOARD_URL
         self.device_tokens = DEVICE_CREDENTIALS
         self.session = requests.Session()
-        
+
         # Configure SSL context for secure connections
         self.session.verify = True  # Verify SSL certificates
-        logger.info("ThingsBoard HTTP client initialized with SSL")
 
-    def send_telemetry(self, device_name, data):
-        """Send telemetry data via HTTPS API"""
+        # Connection pooling + keep-alive with retries, so successive
+        # batches reuse the same TLS connection instead of reconnecting
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=8,
+            max_retries=Retry(total=3, backoff_factor=0.5)
+        )
+        self.session.mount('https://', adapter)
+        logger.info("ThingsBoard HTTP client initialized with SSL and connection pooling")
+
+    def send_batch(self, token, data, ts=None):
+        """Send a batch of telemetry key/value pairs in a single HTTPS POST"""
         try:
-            token = self.device_tokens.get(device_name)
-            if not token:
-                logger.error(f"No token found for device: {device_name}")
-                return False
-                
             url = f"{self.base_url}/api/v1/{token}/telemetry"
-            
+
             headers = {
                 'Content-Type': 'application/json',
                 'Accept': 'application/json'
             }
-            
-            # Prepare payload
-            if isinstance(data, dict):
-                payload = data
-            else:
-                payload = {device_name: data}
-            
-            # Add timestamp
-            payload["ts"] = int(time.time() * 1000)
-            
-            logger.debug(f"Sending telemetry for {device_name}: {payload}")
-            
+
+            # One shared timestamp for the whole batch
+            payload = dict(data)
+            payload["ts"] = ts if ts is not None else int(time.time() * 1000)
+
+            logger.debug(f"Sending telemetry batch: {payload}")
+
             response = self.session.post(
-                url, 
-                data=json.dumps(payload),
+                url,
+                data=json_dumps(payload),
                 headers=headers,
                 timeout=30
             )
-            
+
             if response.status_code in [200, 201]:
-                logger.info(f"HTTPS telemetry SENT for {device_name}")
+                logger.info(f"HTTPS telemetry batch SENT ({len(data)} sensors)")
                 return True
             else:
-                logger.error(f"HTTPS telemetry FAILED for {device_name}: {response.status_code} - {response.text}")
+                logger.error(f"HTTPS telemetry batch FAILED: {response.status_code} - {response.text}")
                 return False
-                
+
         except requests.exceptions.SSLError as e:
-            logger.error(f"SSL error for {device_name}: {str(e)}")
+            logger.error(f"SSL error sending batch: {str(e)}")
             return False
         except requests.exceptions.ConnectionError as e:
-            logger.error(f"Connection error for {device_name}: {str(e)}")
+            logger.error(f"Connection error sending batch: {str(e)}")
             return False
         except requests.exceptions.Timeout as e:
-            logger.error(f"Timeout for {device_name}: {str(e)}")
+            logger.error(f"Timeout sending batch: {str(e)}")
             return False
         except Exception as e:
-            logger.error(f"HTTPS telemetry exception for {device_name}: {str(e)}")
+            logger.error(f"HTTPS telemetry batch exception: {str(e)}")
             return False
 
 class SensorMonitor:
@@ -275,9 +422,30 @@ class SensorMonitor:
         # Initialize I2C and ADS1115 from config
         self.i2c = busio.I2C(board.SCL, board.SDA)
         self.ads = ADS.ADS1115(self.i2c, address=config['hardware']['ads1115_address'])
+        # Fastest conversion rate so back-to-back samples are not
+        # limited by the default 128 SPS data rate
+        self.ads.data_rate = 860
+
+        # Construct the four AnalogIn channels once; rebuilding them per
+        # sample allocated a new object and reconfigured the ADC mux on
+        # every single read
+        self._ain = {
+            "pH": AnalogIn(self.ads, ADS.P0),
+            "conductivity": AnalogIn(self.ads, ADS.P1),
+            "recirc_pump": AnalogIn(self.ads, ADS.P2),
+            "dispense_pump": AnalogIn(self.ads, ADS.P3),
+        }
 
-        # Initialize HTTP client for ThingsBoard
-        self.http_client = ThingsBoardHTTPClient()
+        # Initialize ThingsBoard client: persistent MQTT when available,
+        # otherwise fall back to per-request HTTPS
+        self.tb_client = None
+        if MQTT_AVAILABLE:
+            try:
+                self.tb_client = ThingsBoardMQTTClient()
+            except Exception as e:
+                logger.error(f"MQTT client initialization failed, falling back to HTTPS: {e}")
+        if self.tb_client is None:
+            self.tb_client = ThingsBoardHTTPClient()
         
         # Initialize UPS Monitor from config
         self.ups_monitor = UPSMonitor(
@@ -286,40 +454,70 @@ class SensorMonitor:
         )
         
         # Sensor data cache
-        self.sensor_data = {
-            "temperature": None,
-            "pH": None,
-            "conductivity": None,
-            "level": None,
-            "recirc_pump": None,
-            "dispense_pump": None,
-            "ups_battery": None
-        }
-
-        # Timer control
-        self._timer = None
-        self._ups_timer = None
+        self.sensor_data = {key: None for key in SENSOR_KEYS}
+
+        # Fixed-size ring buffers of recent readings per sensor; a full
+        # deque with maxlen appends without allocating, and the rolling
+        # median debounces single-sample outliers in check_alerts
+        history_length = config['sensors'].get('history_length', 16)
+        self._history = {key: collections.deque(maxlen=history_length)
+                         for key in SENSOR_KEYS}
+
+        # Cache the DS18B20 instance: its constructor rescans the
+        # 1-Wire device directory, which we only need to do once (or
+        # again after a read failure)
+        self._ds18b20 = None
+        try:
+            self._ds18b20 = DS18B20()
+        except Exception as e:
+            logger.error(f"DS18B20 initialization failed: {e}")
+
+        # Preallocated sample buffers reused by every filtered read;
+        # the ultrasonic sensor gets its own so it can sample while the
+        # ADC group is running on another worker
+        self._buf = np.empty(SAMPLE_COUNT, dtype=np.float32)
+        self._level_buf = np.empty(SAMPLE_COUNT, dtype=np.float32)
+
+        # Worker pool for overlapping sensors on independent buses;
+        # the four ADS1115 channels share one I2C device, so their
+        # reads stay serialized behind this lock
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+        self._ads_lock = threading.Lock()
+
+        # Keep the CSV appender open for the process lifetime
+        # (line-buffered so each cycle still hits disk promptly)
+        self._csv = open(config['paths']['data_file'], 'a', buffering=1)
+        self._last_backup_day = None
+
+        # Timestamp of the current cycle, shared by telemetry and the
+        # CSV log so every reading in a cycle correlates
+        self._cycle_ts_ms = None
+
+        # Run state; on_stop lets the asyncio main loop be woken from
+        # worker threads (e.g. the UPS shutdown path)
         self._running = False
+        self.on_stop = None
 
-    def get_filtered_sample(self, sensor_func, samples=SAMPLE_COUNT, discard=DISCARD_COUNT):
+    def get_filtered_sample(self, sensor_func, samples=SAMPLE_COUNT, discard=DISCARD_COUNT, buf=None):
         """
         Take multiple samples, discard outliers, and return average of middle values
         """
         try:
-            readings = []
+            if buf is None:
+                buf = self._buf
+            count = 0
             for _ in range(samples):
                 reading = sensor_func()
                 if reading is not None:
-                    readings.append(reading)
-                time.sleep(0.1)
-            
-            if len(readings) < (samples - discard*2):
-                logger.warning(f"Insufficient valid samples: {len(readings)}/{samples}")
+                    buf[count] = reading
+                    count += 1
+                time.sleep(ADS_CONVERSION_PERIOD)
+
+            if count < (samples - discard*2):
+                logger.warning(f"Insufficient valid samples: {count}/{samples}")
                 return None
-                
-            readings.sort()
-            valid_samples = readings[discard:-discard] if discard > 0 else readings
-            return round(statistics.mean(valid_samples), 2)
+
+            return round(float(_trimmed_mean(buf, count, discard)), 2)
         except Exception as e:
             logger.error(f"Filtered sampling error: {str(e)}")
             return None
@@ -327,42 +525,50 @@ class SensorMonitor:
     def measure_ph(self):
         """Measure pH value with outlier rejection"""
         def ph_measurement():
-            chan = AnalogIn(self.ads, ADS.P0)
-            voltage = chan.voltage
-            # Use calibration formula from config
-            return round((-6.02987 * voltage + 21.91), 2)
+            voltage = self._ain["pH"].voltage
+            # Use calibration formula from config; the filtered mean is
+            # rounded once at the output, not per sample
+            return -6.02987 * voltage + 21.91
         
         self.sensor_data["pH"] = self.get_filtered_sample(ph_measurement)
 
     def measure_conductivity(self):
         """Measure conductivity with outlier rejection"""
         def conductivity_measurement():
-            chan = AnalogIn(self.ads, ADS.P1)
-            voltage = chan.voltage
+            voltage = self._ain["conductivity"].voltage
             # Use calibration formula from config
-            return round((779.3 * voltage - 302.46), 0)
+            return 779.3 * voltage - 302.46
         
-        self.sensor_data["conductivity"] = self.get_filtered_sample(conductivity_measurement)
+        # Whole-unit reading: send an int so the JSON payload stays small
+        value = self.get_filtered_sample(conductivity_measurement)
+        self.sensor_data["conductivity"] = round(value) if value is not None else None
 
     def measure_rpump(self):
         """Measure recirculating pump with outlier rejection"""
         def rpump_measurement():
-            chan = AnalogIn(self.ads, ADS.P2)
-            voltage = round(chan.voltage, 2)
-            # Use calibration formula from config
-            return round(abs((voltage - 2.57)) * 6000, 0)
+            # Use calibration formula from config; rounding the raw
+            # voltage first would quantize away more than the ADC's LSB
+            return abs(self._ain["recirc_pump"].voltage - 2.57) * 6000
         
-        self.sensor_data["recirc_pump"] = self.get_filtered_sample(rpump_measurement)
+        value = self.get_filtered_sample(rpump_measurement)
+        self.sensor_data["recirc_pump"] = round(value) if value is not None else None
 
     def measure_dpump(self):
         """Measure dispensing pump with outlier rejection"""
         def dpump_measurement():
-            chan = AnalogIn(self.ads, ADS.P3)
-            voltage = round(chan.voltage, 2)
             # Use calibration formula from config
-            return round(abs((voltage - 2.56)) * 4000, 0)
+            return abs(self._ain["dispense_pump"].voltage - 2.56) * 4000
         
-        self.sensor_data["dispense_pump"] = self.get_filtered_sample(dpump_measurement)
+        value = self.get_filtered_sample(dpump_measurement)
+        self.sensor_data["dispense_pump"] = round(value) if value is not None else None
+
+    def measure_adc_sensors(self):
+        """Measure all ADS1115-connected sensors, serialized on the shared I2C device"""
+        with self._ads_lock:
+            self.measure_ph()
+            self.measure_conductivity()
+            self.measure_rpump()
+            self.measure_dpump()
 
     def measure_water_level(self):
         """Measure water level with outlier rejection"""
@@ -372,32 +578,32 @@ class SensorMonitor:
             GPIO.output(self.GPIO_TRIG, GPIO.HIGH)
             time.sleep(0.00001)
             GPIO.output(self.GPIO_TRIG, GPIO.LOW)
-            
-            pulse_start = time.time()
-            timeout = pulse_start + 0.04
-            
-            while GPIO.input(self.GPIO_ECHO) == 0 and pulse_start < timeout:
-                pulse_start = time.time()
-            
-            pulse_end = time.time()
-            while GPIO.input(self.GPIO_ECHO) == 1 and pulse_end < timeout:
-                pulse_end = time.time()
-            
-            if pulse_start >= timeout or pulse_end >= timeout:
+
+            # Block in C on the echo edges instead of polling GPIO.input
+            # in a Python loop; wait_for_edge has far lower jitter and
+            # releases the GIL while waiting
+            if GPIO.wait_for_edge(self.GPIO_ECHO, GPIO.RISING, timeout=40) is None:
                 return None
-                
-            pulse_duration = pulse_end - pulse_start
-            dist = 83.0 - round(pulse_duration * 17150, 1)
+            pulse_start = time.perf_counter_ns()
+
+            if GPIO.wait_for_edge(self.GPIO_ECHO, GPIO.FALLING, timeout=40) is None:
+                return None
+            pulse_end = time.perf_counter_ns()
+
+            pulse_duration = (pulse_end - pulse_start) * 1e-9
+            dist = 83.0 - pulse_duration * 17150
             # Use calibration formula from config
-            return round(dist * 46.72, 0)
+            return dist * 46.72
         
-        self.sensor_data["level"] = self.get_filtered_sample(level_measurement)
+        value = self.get_filtered_sample(level_measurement, buf=self._level_buf)
+        self.sensor_data["level"] = round(value) if value is not None else None
 
     def measure_temperature(self):
         """Measure temperature from DS18B20 sensor"""
         try:
-            sensor = DS18B20()
-            temp = sensor.get_temperature()
+            if self._ds18b20 is None:
+                self._ds18b20 = DS18B20()
+            temp = self._ds18b20.get_temperature()
             if temp is not None:
                 # Use calibration offset from config
                 self.sensor_data["temperature"] = round((temp + config['calibration']['temperature_offset']), 1)
@@ -405,6 +611,8 @@ class SensorMonitor:
                 self.sensor_data["temperature"] = None
         except Exception as e:
             logger.error(f"Temperature measurement error: {str(e)}")
+            # Drop the cached instance so the next cycle rescans the bus
+            self._ds18b20 = None
             self.sensor_data["temperature"] = None
 
     def measure_ups_battery(self):
@@ -414,60 +622,56 @@ class SensorMonitor:
         return battery_level
 
     def send_pushover_notification(self, message):
-        """Send notification via Pushover with SSL context"""
+        """Send notification via Pushover over the shared keep-alive session"""
         try:
-            context = ssl.create_default_context()
-            conn = http.client.HTTPSConnection("api.pushover.net:443", context=context)
-            conn.request("POST", "/1/messages.json",
-                urllib.parse.urlencode({
-                    "token": PUSHOVER_TOKEN,
-                    "user": PUSHOVER_USER,
-                    "message": message,
-                }), {"Content-type": "application/x-www-form-urlencoded"})
-            response = conn.getresponse()
-            if response.status != 200:
-                logger.error(f"Pushover notification failed: {response.status} {response.reason}")
+            response = pushover_session.post(PUSHOVER_API_URL, data={
+                "token": PUSHOVER_TOKEN,
+                "user": PUSHOVER_USER,
+                "message": message,
+            }, timeout=30)
+            if response.status_code != 200:
+                logger.error(f"Pushover notification failed: {response.status_code} {response.reason}")
             else:
                 logger.info("Pushover notification sent successfully")
-            conn.close()
         except Exception as e:
             logger.error(f"Failed to send Pushover notification: {str(e)}")
 
+    # (sensor key, low-threshold key, high-threshold key, label, unit);
+    # a None threshold key means that direction is not checked
+    _ALERT_RULES = (
+        ("temperature", "temp_low", "temp_high", "Temperature", "°C"),
+        ("pH", "ph_low", "ph_high", "pH", ""),
+        ("level", "level_low", "level_high", "Water level", "L"),
+        ("recirc_pump", "pump_current_low", None, "Recirc pump current", "RPM"),
+        ("dispense_pump", "pump_current_low", None, "Dispense pump current", "RPM"),
+    )
+
     def check_alerts(self):
         """Check sensor readings against thresholds"""
         alerts = []
-        
-        if self.sensor_data["temperature"] is not None:
-            if self.sensor_data["temperature"] < ALERT_THRESHOLDS["temp_low"]:
-                alerts.append(f"Temperature low: {self.sensor_data['temperature']}°C")
-            elif self.sensor_data["temperature"] > ALERT_THRESHOLDS["temp_high"]:
-                alerts.append(f"Temperature high: {self.sensor_data['temperature']}°C")
-        
-        if self.sensor_data["pH"] is not None:
-            if self.sensor_data["pH"] < ALERT_THRESHOLDS["ph_low"]:
-                alerts.append(f"pH low: {self.sensor_data['pH']}")
-            elif self.sensor_data["pH"] > ALERT_THRESHOLDS["ph_high"]:
-                alerts.append(f"pH high: {self.sensor_data['pH']}")
-        
-        if self.sensor_data["level"] is not None:
-            if self.sensor_data["level"] < ALERT_THRESHOLDS["level_low"]:
-                alerts.append(f"Water level low: {self.sensor_data['level']}L")
-            elif self.sensor_data["level"] > ALERT_THRESHOLDS["level_high"]:
-                alerts.append(f"Water level high: {self.sensor_data['level']}L")
-        
-        if self.sensor_data["recirc_pump"] is not None:
-            if self.sensor_data["recirc_pump"] < ALERT_THRESHOLDS["pump_current_low"]:
-                alerts.append(f"Recirc pump current low: {self.sensor_data['recirc_pump']}RPM")
-        
-        if self.sensor_data["dispense_pump"] is not None:
-            if self.sensor_data["dispense_pump"] < ALERT_THRESHOLDS["pump_current_low"]:
-                alerts.append(f"Dispense pump current low: {self.sensor_data['dispense_pump']}RPM")
-        
-        # Check UPS battery alert (warning level, not shutdown level)
-        if self.sensor_data["ups_battery"] is not None:
-            if self.sensor_data["ups_battery"] <= ALERT_THRESHOLDS["ups_battery_low"]:
-                alerts.append(f"UPS Battery low: {self.sensor_data['ups_battery']}%")
-        
+        _data = self.sensor_data
+        _thr = ALERT_THRESHOLDS
+
+        for key, lo, hi, label, unit in self._ALERT_RULES:
+            value = _data[key]
+            if value is None:
+                continue
+            # Trigger on the rolling median so a single outlier sample
+            # cannot fire a spurious alert; the message still reports
+            # the latest reading
+            history = self._history[key]
+            median = statistics.median(history) if history else value
+            if lo and median < _thr[lo]:
+                alerts.append(f"{label} low: {value}{unit}")
+            elif hi and median > _thr[hi]:
+                alerts.append(f"{label} high: {value}{unit}")
+
+        # Check UPS battery alert (warning level, not shutdown level);
+        # kept out of the table because it triggers at <=, not <
+        if _data["ups_battery"] is not None:
+            if _data["ups_battery"] <= _thr["ups_battery_low"]:
+                alerts.append(f"UPS Battery low: {_data['ups_battery']}%")
+
         if alerts:
             alert_message = "RAS Alerts:\n" + "\n".join(alerts)
             logger.warning(f"Alerts triggered: {alert_message}")
@@ -476,48 +680,76 @@ class SensorMonitor:
     def log_data(self):
         """Log data to CSV file"""
         try:
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d,%H:%M:%S")
-            data = [
-                self.sensor_data["temperature"] or "",
-                self.sensor_data["pH"] or "",
-                self.sensor_data["conductivity"] or "",
-                self.sensor_data["level"] or "",
-                self.sensor_data["recirc_pump"] or "",
-                self.sensor_data["dispense_pump"] or "",
-                self.sensor_data["ups_battery"] or ""
-            ]
-            csv_line = f"{timestamp},{','.join(map(str, data))}\n"
-            
-            with open(config['paths']['data_file'], 'a') as f:
-                f.write(csv_line)
-            
-            # Backup data
-            shutil.copy(config['paths']['data_file'], config['paths']['backup_path'])
+            # Derive the CSV timestamp from the cycle timestamp so the
+            # log and the telemetry carry the same instant
+            ts_ms = self._cycle_ts_ms or time.time_ns() // 1_000_000
+            timestamp = time.strftime("%Y-%m-%d,%H:%M:%S", time.localtime(ts_ms / 1000))
+            self._csv.write(CSV_FMT.format(
+                timestamp,
+                *[self.sensor_data[k] if self.sensor_data[k] is not None else ""
+                  for k in SENSOR_KEYS]
+            ))
+
+            # Backup data (at most once per day)
+            self._backup_data_file()
         except Exception as e:
             logger.error(f"Data logging failed: {str(e)}")
 
+    def _backup_data_file(self):
+        """Snapshot the CSV to the backup path, at most once per day"""
+        today = datetime.date.today()
+        if self._last_backup_day == today:
+            return
+        try:
+            backup_path = config['paths']['backup_path']
+            try:
+                # Hardlink snapshot is free when both paths share a filesystem
+                if os.path.exists(backup_path):
+                    os.remove(backup_path)
+                os.link(config['paths']['data_file'], backup_path)
+            except OSError:
+                # Backup target on another filesystem (e.g. USB stick)
+                shutil.copy(config['paths']['data_file'], backup_path)
+            self._last_backup_day = today
+        except Exception as e:
+            logger.error(f"Data backup failed: {str(e)}")
+
     def publish_data(self):
-        """Publish all sensor data via HTTPS API"""
+        """Publish all sensor data in batches (one per device token)"""
         try:
+            # Group sensors sharing the same device token into one payload
+            batches = {}
+            for sensor_name, value in self.sensor_data.items():
+                if value is None:
+                    continue
+                token = DEVICE_CREDENTIALS.get(sensor_name)
+                if not token:
+                    logger.error(f"No token found for device: {sensor_name}")
+                    continue
+                batches.setdefault(token, {})[sensor_name] = value
+
+            if not batches:
+                logger.warning("No sensor data to publish")
+                return
+
+            # The cycle timestamp is shared by every batch so readings
+            # stay correlated across devices
+            ts = self._cycle_ts_ms or int(time.time() * 1000)
+
             success_count = 0
             total_sensors = 0
-            
-            for sensor_name, value in self.sensor_data.items():
-                if value is not None:
-                    total_sensors += 1
-                    success = self.http_client.send_telemetry(sensor_name, value)
-                    if success:
-                        success_count += 1
-                    # Small delay to avoid rate limiting
-                    time.sleep(0.5)
-                    
+            for token, payload in batches.items():
+                total_sensors += len(payload)
+                if self.tb_client.send_batch(token, payload, ts):
+                    success_count += len(payload)
+
             if success_count > 0:
-                logger.info(f"Data published via HTTPS API ({success_count}/{total_sensors} sensors)")
+                logger.info(f"Data published to ThingsBoard ({success_count}/{total_sensors} sensors)")
             else:
-                logger.error(f"All HTTPS telemetry attempts failed ({total_sensors} sensors)")
-                
+                logger.error(f"All telemetry attempts failed ({total_sensors} sensors)")
+
         except Exception as e:
-            logger.error(f"HTTPS publish failed: {str(e)}")
+            logger.error(f"Telemetry publish failed: {str(e)}")
 
     def ups_monitoring_cycle(self):
         """UPS battery monitoring cycle"""
@@ -535,10 +767,6 @@ class SensorMonitor:
                 
         except Exception as e:
             logger.error(f"UPS monitoring error: {e}")
-        finally:
-            if self._running:
-                self._ups_timer = Timer(UPS_CHECK_INTERVAL, self.ups_monitoring_cycle)
-                self._ups_timer.start()
 
     def collect_and_publish(self):
         """Main collection and publishing routine"""
@@ -547,15 +775,26 @@ class SensorMonitor:
             
         try:
             logger.info("Starting sensor data collection cycle")
-            
-            # Measure all sensors including UPS battery
-            self.measure_temperature()
-            self.measure_ph()
-            self.measure_conductivity()
-            self.measure_rpump()
-            self.measure_dpump()
-            self.measure_water_level()
-            self.measure_ups_battery()
+
+            # One timestamp for the whole cycle
+            self._cycle_ts_ms = time.time_ns() // 1_000_000
+
+            # Measure all sensors including UPS battery; the 1-Wire,
+            # GPIO, UPS, and ADC reads sit on independent buses so
+            # they run concurrently and the cycle takes the slowest
+            # sensor rather than the sum of all of them
+            futures = [
+                self._pool.submit(self.measure_temperature),
+                self._pool.submit(self.measure_adc_sensors),
+                self._pool.submit(self.measure_water_level),
+                self._pool.submit(self.measure_ups_battery),
+            ]
+            concurrent.futures.wait(futures)
+
+            # Record readings in the per-sensor ring buffers
+            for key, value in self.sensor_data.items():
+                if value is not None:
+                    self._history[key].append(value)
 
             # Process data
             self.publish_data()
@@ -565,45 +804,71 @@ class SensorMonitor:
             logger.info(f"Completed cycle at {datetime.datetime.now()}")
         except Exception as e:
             logger.error(f"Collection cycle failed: {str(e)}")
-        finally:
-            if self._running:
-                self._timer = Timer(PUBLISH_INTERVAL, self.collect_and_publish)
-                self._timer.start()
 
     def run(self):
         """Start the monitoring system"""
         self._running = True
         logger.info("Starting RAS monitoring system with UPS protection")
         logger.info(f"UPS shutdown threshold: {UPS_SHUTDOWN_THRESHOLD}%")
-        
-        # Start both monitoring cycles
-        self.collect_and_publish()
-        self.ups_monitoring_cycle()
 
     def stop(self):
         """Stop the monitoring system"""
         self._running = False
-        if self._timer:
-            self._timer.cancel()
-        if self._ups_timer:
-            self._ups_timer.cancel()
+        if self.on_stop is not None:
+            self.on_stop()
         logger.info("Monitoring system stopped")
 
     def cleanup(self):
         """Clean up resources"""
         self.stop()
+        self._pool.shutdown(wait=False)
+        if isinstance(self.tb_client, ThingsBoardMQTTClient):
+            self.tb_client.disconnect()
+        self.ups_monitor.close()
+        self._csv.close()
         GPIO.cleanup()
         logger.info("System cleanup completed")
 
-if __name__ == "__main__":
+async def _periodic(interval, func, stop_event):
+    """Run a blocking task off the event loop every `interval` seconds until stopped"""
+    loop = asyncio.get_running_loop()
+    while not stop_event.is_set():
+        await loop.run_in_executor(None, func)
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+async def main():
     monitor = SensorMonitor()
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    # stop() may fire from a worker thread (UPS shutdown path), so it
+    # wakes the loop through call_soon_threadsafe
+    monitor.on_stop = lambda: loop.call_soon_threadsafe(stop_event.set)
+
+    # Wake only on a signal instead of polling a flag every second
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    monitor.run()
+    tasks = [
+        asyncio.create_task(_periodic(PUBLISH_INTERVAL, monitor.collect_and_publish, stop_event)),
+        asyncio.create_task(_periodic(UPS_CHECK_INTERVAL, monitor.ups_monitoring_cycle, stop_event)),
+    ]
     try:
-        monitor.run()
-        while monitor._running:
-            time.sleep(1)
+        await stop_event.wait()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        monitor.cleanup()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Received keyboard interrupt")
     except Exception as e:
-        logger.error(f"Fatal error: {str(e)}")
-    finally:
-        monitor.cleanup()
\ No newline at end of file
+        logger.error(f"Fatal error: {str(e)}")
\ No newline at end of file